@@ -1,14 +1,34 @@
+"""Aalto Fuksi Telegram bot.
+
+Restaurant data from the Kanttiinit API is cached in memory: the Otaniemi
+restaurant list is reloaded at most every 6 hours (``RESTAURANT_TTL``), so
+button rendering does not trigger an HTTP request on every interaction.
+If a reload fails, the old list keeps being served and the reload is retried
+after ``RESTAURANT_RETRY``.
+All requests go through a shared ``httpx.AsyncClient`` stored in
+``bot_data["http"]``, so a slow request does not block other handlers.
+
+When a canteen is picked for the menu, the menus of all the offered dates
+are prefetched in one request and kept in ``user_data`` for 30 minutes
+(``MENU_TTL``).
+"""
+
 from __future__ import annotations
 
-import json
+import asyncio
+import functools
 import logging
 import os
+import re
+import time
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, fields
 from datetime import date, timedelta
 from typing import Generic, TypeVar
 
-import requests
+import httpx
+import orjson
+import uvloop
 from dotenv import load_dotenv
 from telegram import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.constants import ParseMode
@@ -21,15 +41,23 @@ from telegram.ext import (
 )
 
 load_dotenv()
+logging.Formatter.default_msec_format = None
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
 )
+# httpx logs every request on INFO
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
 
 TOKEN = os.getenv("API_TOKEN", "")
 if not TOKEN:
     raise ValueError("Missing API_TOKEN")
 
 BASE_URL = "https://kitchen.kanttiinit.fi"
+RESTAURANT_TTL = 6 * 60 * 60  # seconds
+RESTAURANT_RETRY = 60  # seconds until a failed reload is retried
+MENU_TTL = 30 * 60  # seconds
+_WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
 
 # ------------- Interface --------------------
 
@@ -55,18 +83,49 @@ RES_TYPE = TypeVar("RES_TYPE", bound=Restaurant)
 class RestaurantManager(ABC, Generic[RES_TYPE]):
     """Restaurant manager interface."""
 
-    _rest: dict[str, RES_TYPE] = {}
+    _rest: dict[str, RES_TYPE]
+    _rest_loaded_at: float
+    _load_lock: asyncio.Lock
+    # incremented on every reload, used to invalidate derived caches
+    version: int
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # every manager gets its own cache and lock instead of sharing the base's
+        cls._rest = {}
+        cls._rest_loaded_at = 0.0
+        cls._load_lock = asyncio.Lock()
+        cls.version = 0
+
+    @classmethod
+    def _is_stale(cls) -> bool:
+        return not cls._rest or time.monotonic() - cls._rest_loaded_at > RESTAURANT_TTL
 
     @classmethod
-    def restaurants(cls) -> dict[str, RES_TYPE]:
-        """Singleton for a dictionary of restaurants."""
-        if not cls._rest:
-            cls._load_restaurants()
+    async def restaurants(cls, client: httpx.AsyncClient) -> dict[str, RES_TYPE]:
+        """Cached dictionary of restaurants, reloaded after ``RESTAURANT_TTL``."""
+        if cls._is_stale():
+            # only one handler reloads, the others wait for its result
+            async with cls._load_lock:
+                if cls._is_stale():
+                    try:
+                        await cls._load_restaurants(client)
+                    except Exception:
+                        # without any data there is nothing to fall back to
+                        if not cls._rest:
+                            raise
+                        logger.exception("Reloading restaurants failed, using old data")
+                        cls._rest_loaded_at = (
+                            time.monotonic() - RESTAURANT_TTL + RESTAURANT_RETRY
+                        )
+                        return cls._rest
+                    cls._rest_loaded_at = time.monotonic()
+                    cls.version += 1
         return cls._rest
 
     @classmethod
     @abstractmethod
-    def _load_restaurants(cls):
+    async def _load_restaurants(cls, client: httpx.AsyncClient):
         raise NotImplemented()
 
 
@@ -75,11 +134,18 @@ class MenuManager(ABC, Generic[MENU_TYPE]):
 
     @staticmethod
     @abstractmethod
-    def get_restaurant_menu(
-        restaurant_id: int | str, d: str = str(date.today())
+    async def get_restaurant_menu(
+        client: httpx.AsyncClient, restaurant_id: int | str, d: str = str(date.today())
     ) -> list[MENU_TYPE]:
         raise NotImplemented
 
+    @staticmethod
+    @abstractmethod
+    async def get_restaurant_menus(
+        client: httpx.AsyncClient, restaurant_id: int | str, days: list[str]
+    ) -> dict[str, list[MENU_TYPE]]:
+        raise NotImplemented
+
 
 # ---------------- Class Implementations ------------
 
@@ -100,23 +166,29 @@ class KanttiinitRestaurant(Restaurant):
     address: str
     openingHours: list[str]
 
-    def __init__(self, **kwargs):
-        names = set([f.name for f in fields(self)])
-        for k, v in kwargs.items():
-            if k in names:
-                setattr(self, k, v)
+
+_RESTAURANT_FIELDS = frozenset(f.name for f in fields(KanttiinitRestaurant))
 
 
 class KanttiinitRestaurantManager(RestaurantManager[KanttiinitRestaurant]):
 
     @classmethod
-    def _load_restaurants(cls):
-        res = requests.get(url=f"{BASE_URL}/areas", params={"lang": "en"})
-        otamiemi_area = [area for area in json.loads(res.text) if area["name"] == "Otaniemi"]
+    async def _load_restaurants(cls, client: httpx.AsyncClient):
+        res = await client.get("/areas", params={"lang": "en"})
+        res.raise_for_status()
+        otaniemi_area = next(
+            (area for area in orjson.loads(res.content) if area["name"] == "Otaniemi"),
+            None,
+        )
+        if otaniemi_area is None:
+            raise ValueError("Otaniemi area not found")
         cls._rest = {
-            str(rest["id"]): KanttiinitRestaurant(**rest)
-            for rest in otamiemi_area[0]["restaurants"]
+            str(rest["id"]): KanttiinitRestaurant(
+                **{k: v for k, v in rest.items() if k in _RESTAURANT_FIELDS}
+            )
+            for rest in otaniemi_area["restaurants"]
         }
+        logger.info("Loaded %d Kanttiinit restaurants", len(cls._rest))
 
 
 @dataclass
@@ -133,18 +205,30 @@ class KanttiinitMenu(Menu):
 class KanttiinitMenuManager(MenuManager[KanttiinitMenu]):
 
     @staticmethod
-    def get_restaurant_menu(
-        restaurant_id: int | str, d: str = str(date.today())
+    async def get_restaurant_menu(
+        client: httpx.AsyncClient, restaurant_id: int | str, d: str = str(date.today())
     ) -> list[KanttiinitMenu]:
         """Get a menu for the given canteen and date."""
-        res = requests.get(
-            url=f"{BASE_URL}/menus",
-            params={"restaurants": restaurant_id, "days": str(d), "lang": "en"},
+        menus = await KanttiinitMenuManager.get_restaurant_menus(
+            client, restaurant_id, [str(d)]
         )
-        return [
-            KanttiinitMenu(**menu)
-            for menu in json.loads(res.text)[str(restaurant_id)].get(d, [])
-        ]
+        return menus[str(d)]
+
+    @staticmethod
+    async def get_restaurant_menus(
+        client: httpx.AsyncClient, restaurant_id: int | str, days: list[str]
+    ) -> dict[str, list[KanttiinitMenu]]:
+        """Get the menus for the given canteen and dates in a single request."""
+        res = await client.get(
+            "/menus",
+            params={"restaurants": restaurant_id, "days": ",".join(days), "lang": "en"},
+        )
+        res.raise_for_status()
+        # the query is narrowed to one restaurant and the given days on the
+        # server side, so the payload holds nothing but the requested menus;
+        # a restaurant without any menu on those days is left out
+        menus = orjson.loads(res.content).get(str(restaurant_id), {})
+        return {d: [KanttiinitMenu(**menu) for menu in menus.get(d, [])] for d in days}
 
 
 # ------------- BOT --------------------
@@ -159,39 +243,46 @@ def generate_cancel_send_buttons(callback_suffix: str) -> list[InlineKeyboardBut
     return keyboard
 
 
-def generate_canteen_buttons(callback_prefix: str) -> InlineKeyboardMarkup:
+async def generate_canteen_buttons(
+    client: httpx.AsyncClient, callback_prefix: str
+) -> InlineKeyboardMarkup:
     """Generate the canteen picker buttons."""
-    rest = list(KanttiinitRestaurantManager.restaurants().values())
+    await KanttiinitRestaurantManager.restaurants(client)
+    return _build_canteen_markup(callback_prefix, KanttiinitRestaurantManager.version)
+
+
+@functools.lru_cache(maxsize=8)
+def _build_canteen_markup(callback_prefix: str, version: int) -> InlineKeyboardMarkup:
+    """Build the canteen picker keyboard for the given restaurants version."""
+    rest = list(KanttiinitRestaurantManager._rest.values())
+    n = len(rest)
+
+    # one row per pair of canteens, plus a row for the cancel button
+    keyboard: list[list[InlineKeyboardButton]] = [[] for _ in range((n + 1) // 2 + 1)]
 
     # divide buttons into two columns
-    keyboard = [
-        [
+    for i in range(0, n - 1, 2):
+        keyboard[i // 2] = [
             InlineKeyboardButton(
-                p[0].name, callback_data=f"{callback_prefix}_{p[0].id}"
+                rest[i].name, callback_data=f"{callback_prefix}_{rest[i].id}"
             ),
             InlineKeyboardButton(
-                p[1].name, callback_data=f"{callback_prefix}_{p[1].id}"
+                rest[i + 1].name, callback_data=f"{callback_prefix}_{rest[i + 1].id}"
             ),
         ]
-        for p in zip(rest[::2], rest[1::2])
-    ]
 
     # if there is an odd number of canteens
     # stretch the last button across two columns
-    if len(rest) % 2 == 1:
-        keyboard.append(
-            [
-                InlineKeyboardButton(
-                    rest[-1].name, callback_data=f"{callback_prefix}_{rest[-1].id}"
-                ),
-            ]
-        )
-    # add a cancel button
-    keyboard.append(
-        [
-            InlineKeyboardButton("Cancel", callback_data=f"cancel"),
+    if n % 2 == 1:
+        keyboard[n // 2] = [
+            InlineKeyboardButton(
+                rest[-1].name, callback_data=f"{callback_prefix}_{rest[-1].id}"
+            ),
         ]
-    )
+    # add a cancel button
+    keyboard[-1] = [
+        InlineKeyboardButton("Cancel", callback_data=f"cancel"),
+    ]
 
     # send a reply to the command
     return InlineKeyboardMarkup(keyboard)
@@ -205,6 +296,20 @@ async def cancel_handler(update: Update, _: ContextTypes.DEFAULT_TYPE):
     await query.delete_message()
 
 
+def _wrap_code(message: str) -> str:
+    """Bold the title line and put the rest into a code block."""
+    head, _, tail = message.partition("\n")
+    return f"<b>{head}</b>\n<code>{tail}</code>"
+
+
+# operation -> transformation of the message to send
+_SEND_TRANSFORMS = {
+    "opening_hours": _wrap_code,
+    "menu": _wrap_code,
+    "link": lambda message: message,
+}
+
+
 async def send_handler(update: Update, _: ContextTypes.DEFAULT_TYPE):
     """Send the current message."""
     # input check
@@ -217,18 +322,13 @@ async def send_handler(update: Update, _: ContextTypes.DEFAULT_TYPE):
 
     op = query.data.removeprefix("send_")
     orig_msg = query.message.text
-    message = "Command not found"
-    if op == "opening_hours" or op == "menu":
-        message = orig_msg.split("\n")
-        content = "\n".join(message[1:])
-        message = f"<b>{message[0]}</b>\n<code>{content}</code>"
-    elif op == "link":
-        message = orig_msg
+    transform = _SEND_TRANSFORMS.get(op)
+    message = transform(orig_msg) if transform else "Command not found"
 
     await query.edit_message_text(text=message, parse_mode=ParseMode.HTML)
 
 
-async def opening_hours_handler(update: Update, _: ContextTypes.DEFAULT_TYPE):
+async def opening_hours_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Display the opening hours for the chosen canteen."""
     # input check
     query = update.callback_query
@@ -239,16 +339,15 @@ async def opening_hours_handler(update: Update, _: ContextTypes.DEFAULT_TYPE):
         return
 
     # generate all the buttons
-    rest = KanttiinitRestaurantManager.restaurants()[
-        query.data.removeprefix("opening_hours_")
-    ]
+    restaurants = await KanttiinitRestaurantManager.restaurants(
+        context.bot_data["http"]
+    )
+    rest = restaurants[query.data.removeprefix("opening_hours_")]
     reply_markup = InlineKeyboardMarkup([generate_cancel_send_buttons("opening_hours")])
 
     # generate the message
-    message = f"<b>{rest.name}</b>\n<code>"
-    for oh in zip(["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"], rest.openingHours):
-        message += f"{oh[0]}: {oh[1]}\n"
-    message += "</code>"
+    body = "\n".join(f"{d}: {h}" for d, h in zip(_WEEKDAYS, rest.openingHours))
+    message = f"<b>{rest.name}</b>\n<code>{body}\n</code>"
 
     # send the message
     await query.edit_message_text(
@@ -256,9 +355,13 @@ async def opening_hours_handler(update: Update, _: ContextTypes.DEFAULT_TYPE):
     )
 
 
-async def opening_hours_buttons(query: CallbackQuery):
+async def opening_hours_buttons(
+    query: CallbackQuery, context: ContextTypes.DEFAULT_TYPE
+):
     """Display canteen picker for the opening hours option."""
-    reply_markup = generate_canteen_buttons("opening_hours")
+    reply_markup = await generate_canteen_buttons(
+        context.bot_data["http"], "opening_hours"
+    )
     await query.edit_message_text(
         "<b>Opening Hours</b>\nChoose the canteen:",
         parse_mode=ParseMode.HTML,
@@ -274,12 +377,15 @@ async def link_handler(query: CallbackQuery):
     )
 
 
-async def menu_canteen_handler(query: CallbackQuery):
+async def menu_canteen_handler(
+    query: CallbackQuery, context: ContextTypes.DEFAULT_TYPE
+):
     """Display a canteen picker."""
-    reply_markup = generate_canteen_buttons("menu_canteen")
+    reply_markup = await generate_canteen_buttons(
+        context.bot_data["http"], "menu_canteen"
+    )
 
     # generate the final message
-    await query.answer()
     await query.edit_message_text(
         "<b>Menu</b>\nChoose the canteen:",
         parse_mode=ParseMode.HTML,
@@ -287,7 +393,73 @@ async def menu_canteen_handler(query: CallbackQuery):
     )
 
 
-async def menu_date_pick_handler(update: Update, _: ContextTypes.DEFAULT_TYPE):
+def _menu_dates(today: date) -> list[date]:
+    """Dates offered by the menu date picker."""
+    return [today + timedelta(days=i) for i in range(7)]
+
+
+async def _prefetch_menus(
+    client: httpx.AsyncClient, user_data: dict, _id: str, today: date
+):
+    """Fetch the menus for all the offered dates and cache them for the user."""
+    try:
+        menus = await KanttiinitMenuManager.get_restaurant_menus(
+            client, _id, [str(d) for d in _menu_dates(today)]
+        )
+    except httpx.HTTPError:
+        # the menu display falls back to fetching the chosen date on its own
+        logger.warning("Prefetching menus of %s failed", _id, exc_info=True)
+        return
+
+    # drop the menus of other canteens that are no longer fresh
+    now = time.monotonic()
+    for key in [
+        k
+        for k, v in user_data.items()
+        if k.startswith("menus:") and now - v[0] > MENU_TTL
+    ]:
+        del user_data[key]
+    user_data[f"menus:{_id}"] = (now, menus)
+
+
+def _cached_menu(
+    user_data: dict | None, _id: str, _date: str
+) -> list[KanttiinitMenu] | None:
+    """Return the prefetched menu if it is still fresh."""
+    if user_data is None or f"menus:{_id}" not in user_data:
+        return None
+    fetched_at, menus = user_data[f"menus:{_id}"]
+    if time.monotonic() - fetched_at > MENU_TTL:
+        del user_data[f"menus:{_id}"]
+        return None
+    return menus.get(_date)
+
+
+# (today, canteen id) -> date picker keyboard
+_date_kb_cache: dict[tuple[date, str], InlineKeyboardMarkup] = {}
+
+
+def _date_picker_markup(today: date, _id: str) -> InlineKeyboardMarkup:
+    """Date picker keyboard, built once per day and canteen."""
+    key = (today, _id)
+    if key not in _date_kb_cache:
+        if len(_date_kb_cache) > 64:
+            _date_kb_cache.clear()
+        keyboard = [
+            [
+                InlineKeyboardButton(
+                    d.strftime("%d.%m.%y (%a)"),
+                    callback_data=f"menu_date_{str(d)}|{_id}",
+                )
+            ]
+            for d in _menu_dates(today)
+        ]
+        keyboard.append([InlineKeyboardButton("Cancel", callback_data=f"cancel")])
+        _date_kb_cache[key] = InlineKeyboardMarkup(keyboard)
+    return _date_kb_cache[key]
+
+
+async def menu_date_pick_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Display a date picker."""
     # input check
     query = update.callback_query
@@ -300,21 +472,14 @@ async def menu_date_pick_handler(update: Update, _: ContextTypes.DEFAULT_TYPE):
     # extract the canteen's id
     _id = query.data.removeprefix("menu_canteen_")
 
-    # generate the date picker button
-    dates = [date.today() + timedelta(days=i) for i in range(7)]
-    keyboard = [
-        [
-            InlineKeyboardButton(
-                d.strftime("%d.%m.%y (%a)"), callback_data=f"menu_date_{str(d)}|{_id}"
-            )
-        ]
-        for d in dates
-    ]
-    keyboard.append([InlineKeyboardButton("Cancel", callback_data=f"cancel")])
+    today = date.today()
+    if context.user_data is not None:
+        context.application.create_task(
+            _prefetch_menus(context.bot_data["http"], context.user_data, _id, today)
+        )
 
     # generate the final message
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.answer()
+    reply_markup = _date_picker_markup(today, _id)
     await query.edit_message_text(
         text="<b>Menu date</b>\nChoose the date:",
         parse_mode=ParseMode.HTML,
@@ -322,44 +487,46 @@ async def menu_date_pick_handler(update: Update, _: ContextTypes.DEFAULT_TYPE):
     )
 
 
-async def menu_display_handler(update: Update, _: ContextTypes.DEFAULT_TYPE):
+async def menu_display_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Display the menu for the chosen canteen and date."""
+    client: httpx.AsyncClient = context.bot_data["http"]
 
-    def _generate_message(_id: str, _date: str) -> str:
+    async def _get_menu(_id: str, _date: str) -> list[KanttiinitMenu]:
+        """Get the menu from the prefetch cache or the API."""
+        menus = _cached_menu(context.user_data, _id, _date)
+        if menus is None:
+            menus = await KanttiinitMenuManager.get_restaurant_menu(client, _id, _date)
+        return menus
+
+    async def _generate_message(_id: str, _date: str) -> str:
         """Generate a message containing canteen's menu."""
-        message = (
-            f"<b>{KanttiinitRestaurantManager.restaurants()[_id].name} ({_date})</b>\n"
+        # on a cold restaurant cache both requests are in flight at once
+        restaurants, menus = await asyncio.gather(
+            KanttiinitRestaurantManager.restaurants(client), _get_menu(_id, _date)
         )
-
-        message += "<code>"
-        counter = 1
-        for m in KanttiinitMenuManager.get_restaurant_menu(_id, _date):
-            title = m.title.strip()
-            message += f"{counter}. {title}"
-            counter += 1
-            message += "\n"
-        return message + "</code>"
+        rest = restaurants[_id]
+        body = "\n".join(f"{i}. {m.title.strip()}" for i, m in enumerate(menus, 1))
+        return f"<b>{rest.name} ({_date})</b>\n<code>{body}\n</code>"
 
     # input check
     query = update.callback_query
     if not query:
         return
-    if not query.data:
+    if not query.data or not context.match["payload"]:
         await query.delete_message()
         return
-    date, _id = query.data.removeprefix("menu_date_").split("|")
+    date, _, _id = context.match["payload"].partition("|")
 
     reply_markup = InlineKeyboardMarkup([generate_cancel_send_buttons("menu")])
     # update the message sent
-    await query.answer()
     await query.edit_message_text(
-        _generate_message(_id, date),
+        await _generate_message(_id, date),
         parse_mode=ParseMode.HTML,
         reply_markup=reply_markup,
     )
 
 
-async def option_handler(update: Update, _: ContextTypes.DEFAULT_TYPE):
+async def option_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the chosen canteen option."""
     query = update.callback_query
     if not query or not query.data:
@@ -369,9 +536,9 @@ async def option_handler(update: Update, _: ContextTypes.DEFAULT_TYPE):
     if command == "link":
         await link_handler(query)
     elif command == "menu":
-        await menu_canteen_handler(query)
+        await menu_canteen_handler(query, context)
     elif command == "opening-hours":
-        await opening_hours_buttons(query)
+        await opening_hours_buttons(query, context)
     else:
         await query.delete_message()
 
@@ -394,31 +561,58 @@ async def canteens(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+# callback data prefix -> handler
+CALLBACK_HANDLERS = {
+    "option": option_handler,
+    "opening_hours": opening_hours_handler,
+    "menu_canteen": menu_date_pick_handler,
+    "menu_date": menu_display_handler,
+    "send": send_handler,
+    "cancel": cancel_handler,
+}
+CALLBACK_PATTERN = re.compile(
+    f"^(?P<prefix>{'|'.join(CALLBACK_HANDLERS)})(?:_(?P<payload>.*))?"
+)
+
+
+async def callback_dispatcher(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Route a callback query to the handler of its prefix."""
+    # acknowledge right away, so the client doesn't wait for the handler's I/O
+    if update.callback_query:
+        context.application.create_task(update.callback_query.answer())
+    logger.debug("Dispatching callback %s", context.match["prefix"])
+    await CALLBACK_HANDLERS[context.match["prefix"]](update, context)
+
+
 async def post_init(application: Application):
-    """Set the command help."""
+    """Set the command help and create the shared HTTP client."""
     commands = [("canteens", "Otaniemi canteen commands.")]
     await application.bot.set_my_commands(commands)
+    application.bot_data["http"] = httpx.AsyncClient(
+        base_url=BASE_URL, timeout=5.0, http2=True
+    )
+
+
+async def post_shutdown(application: Application):
+    """Close the shared HTTP client."""
+    await application.bot_data["http"].aclose()
 
 
 def main():
-    app = ApplicationBuilder().token(TOKEN).post_init(post_init).build()
+    # libuv based event loop, faster on the bot's many small network requests
+    uvloop.install()
+    app = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     # bot commands
     app.add_handler(CommandHandler("canteens", canteens))
 
     # bot interactive handlers
-    app.add_handler(CallbackQueryHandler(option_handler, pattern="^option"))
-    app.add_handler(
-        CallbackQueryHandler(opening_hours_handler, pattern="^opening_hours")
-    )
-    app.add_handler(
-        CallbackQueryHandler(menu_date_pick_handler, pattern="^menu_canteen")
-    )
-    app.add_handler(CallbackQueryHandler(menu_display_handler, pattern="^menu_date"))
-
-    # back button handlers
-    app.add_handler(CallbackQueryHandler(option_handler, pattern="^menu_canteen_back"))
-    app.add_handler(CallbackQueryHandler(send_handler, pattern="^send"))
-    app.add_handler(CallbackQueryHandler(cancel_handler, pattern="^cancel"))
+    app.add_handler(CallbackQueryHandler(callback_dispatcher, pattern=CALLBACK_PATTERN))
 
     # start polling
     app.run_polling()
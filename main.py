@@ -3,6 +3,8 @@
 import os
 import requests
 from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
 token = os.getenv("TELEGRAM_BOT_TOKEN")
 chat_id = os.getenv("TELEGRAM_CHAT_ID")
@@ -17,7 +19,29 @@ tomorrow = today + timedelta(days=1)
 question = f"Lunch {tomorrow.strftime('%A (%d.%m.%Y)')}"
 options = ["11-12h", "12-13h", "13-14h", "14-15h", "later/other"]
 
-send_poll_result = requests.post(base_url + "sendPoll", json = {
+class SendPollRetry(Retry):
+	"""Retry only the responses after which the poll was certainly not sent."""
+
+	def is_retry(self, method, status_code, has_retry_after=False):
+		# a 503 without Retry-After may come from a gateway after the poll was created
+		if status_code == 503 and not has_retry_after:
+			return False
+		return super().is_retry(method, status_code, has_retry_after)
+
+
+# sendPoll is not idempotent: retry failed connects, rate limits (honoring
+# Retry-After) and 503 with Retry-After, but never read errors or timeouts
+session = requests.Session()
+session.mount("https://", HTTPAdapter(max_retries=SendPollRetry(
+	total=3,
+	read=0,
+	backoff_factor=0.5,
+	status_forcelist=[429, 503],
+	allowed_methods=["POST"],
+	raise_on_status=False,
+)))
+
+send_poll_result = session.post(base_url + "sendPoll", json = {
 	"chat_id": chat_id,
 	"message_thread_id": thread_id,
 	"question": question,